@@ -1,10 +1,35 @@
 # database.py
-from sqlalchemy import create_engine, Column, Integer, String, Float, ForeignKey, DateTime
+from sqlalchemy import create_engine, event, text, table, column, Column, Integer, String, Float, ForeignKey, Index
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.types import TypeDecorator
+from sqlalchemy.pool import StaticPool
 from sqlalchemy.orm import relationship, declarative_base
-from datetime import datetime
+from datetime import datetime, timezone
+import logging
 
 Base = declarative_base()
 
+class EpochDateTime(TypeDecorator):
+    """
+    Stores datetimes as integer Unix epoch seconds and returns them as naive UTC
+    datetimes, like the DateTime column it replaces. init_db converts rows written
+    before the switch, which hold ISO strings.
+    """
+    impl = Integer
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)  # Naive values are UTC
+        return int(value.timestamp())
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        return datetime.fromtimestamp(value, tz=timezone.utc).replace(tzinfo=None)
+
 class Alliance(Base):
     __tablename__ = 'alliances'
     id = Column(Integer, primary_key=True)
@@ -17,7 +42,7 @@ class Player(Base):
     name = Column(String, unique=True)
     race = Column(String)
     alliance_id = Column(Integer, ForeignKey('alliances.id'), nullable=True)  # Made nullable
-    last_update = Column(DateTime, default=datetime.utcnow)
+    last_update = Column(EpochDateTime, default=lambda: datetime.now(timezone.utc))
 
     alliance = relationship('Alliance', back_populates='players')
     planets = relationship('Planet', back_populates='player')
@@ -36,7 +61,7 @@ class Planet(Base):
     attack = Column(Integer)
     defense = Column(Integer)
     invasion_protection = Column(String)
-    player_id = Column(Integer, ForeignKey('players.id'))
+    player_id = Column(Integer, ForeignKey('players.id'), index=True)
 
     player = relationship('Player', back_populates='planets')
     resources = relationship('Resource', back_populates='planet')
@@ -74,7 +99,106 @@ class Setting(Base):
     key = Column(String, primary_key=True)
     value = Column(String)
 
+# Natural keys; also the ON CONFLICT targets of the parser's upserts
+Index('uq_resource_planet_type', Resource.planet_id, Resource.type, unique=True)
+Index('uq_building_planet_name', Building.planet_id, Building.name, unique=True)
+Index('uq_research_player_name', Research.player_id, Research.name, unique=True)
+
+# Indexes matching the query filters/joins
+Index('ix_player_alliance', Player.alliance_id)
+Index('ix_planet_xyz', Planet.x_coord, Planet.y_coord, Planet.z_coord)
+
+# Covering indexes for the top-N building/research/raidable queries: the filter,
+# the ordered/aggregated value and the join key are all read from the index
+Index('ix_building_name_level_planet', Building.name, Building.level.desc(), Building.planet_id)
+Index('ix_research_name_level_player', Research.name, Research.level.desc(), Research.player_id)
+Index('ix_resource_type_raidable_planet', Resource.type, Resource.raidable.desc(), Resource.planet_id)
+
+# Trigram FTS5 indexes over player and alliance names so substring searches
+# (name LIKE '%term%') are answered from the index instead of a table scan.
+# Kept in sync with their tables by triggers; rowid is the player/alliance id.
+SEARCH_INDEXES = {'players_fts': 'players', 'alliances_fts': 'alliances'}
+player_search = table('players_fts', column('rowid'), column('name'))
+alliance_search = table('alliances_fts', column('rowid'), column('name'))
+# False when this SQLite build lacks FTS5 or its trigram tokenizer (3.34+); set by init_db
+_search_indexes_ready = False
+
+def search_indexes_available():
+    """Whether init_db set up the FTS5 name indexes, so searches may query them."""
+    return _search_indexes_ready
+
+def create_search_indexes(conn):
+    """
+    Creates the FTS5 name indexes and their sync triggers if missing, filling a
+    newly created index from the rows already in its table.
+    """
+    for fts, source in SEARCH_INDEXES.items():
+        exists = conn.execute(
+            text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"), {"name": fts}
+        ).first()
+        if exists:
+            continue
+        conn.execute(text(
+            f"CREATE VIRTUAL TABLE {fts} USING fts5(name, content='{source}', content_rowid='id', tokenize='trigram')"
+        ))
+        conn.execute(text(
+            f"CREATE TRIGGER {fts}_ai AFTER INSERT ON {source} BEGIN "
+            f"INSERT INTO {fts}(rowid, name) VALUES (new.id, new.name); END"
+        ))
+        conn.execute(text(
+            f"CREATE TRIGGER {fts}_ad AFTER DELETE ON {source} BEGIN "
+            f"INSERT INTO {fts}({fts}, rowid, name) VALUES ('delete', old.id, old.name); END"
+        ))
+        conn.execute(text(
+            f"CREATE TRIGGER {fts}_au AFTER UPDATE OF name ON {source} BEGIN "
+            f"INSERT INTO {fts}({fts}, rowid, name) VALUES ('delete', old.id, old.name); "
+            f"INSERT INTO {fts}(rowid, name) VALUES (new.id, new.name); END"
+        ))
+        conn.execute(text(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')"))
+    # An index created by a newer SQLite fails here if this build can't read it
+    for fts in SEARCH_INDEXES:
+        conn.execute(text(f"SELECT rowid FROM {fts} WHERE name LIKE '%abc%' LIMIT 1")).all()
+
 def init_db(db_name='espionage_reports.db'):
-    engine = create_engine(f'sqlite:///{db_name}', echo=False)
+    global _search_indexes_ready
+    # One shared connection for the whole app; usable from worker threads,
+    # waits up to 30s on a locked database instead of failing immediately and
+    # keeps up to 256 prepared statements for the repeated menu/parser queries
+    engine = create_engine(
+        f'sqlite:///{db_name}',
+        echo=False,
+        query_cache_size=1200,  # Compiled SQL cache; room for every menu/parser statement shape
+        connect_args={'check_same_thread': False, 'timeout': 30, 'cached_statements': 256},
+        poolclass=StaticPool
+    )
+
+    @event.listens_for(engine, "connect")
+    def set_sqlite_pragmas(dbapi_conn, connection_record):
+        # WAL + NORMAL sync avoids an fsync per page on the insert-heavy parser path
+        cursor = dbapi_conn.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+        cursor.execute("PRAGMA cache_size=-65536")  # 64 MiB
+        cursor.close()
+
     Base.metadata.create_all(engine)
+    # create_all skips indexes on tables that already exist, so add any missing ones
+    for mapped_table in Base.metadata.sorted_tables:
+        for index in mapped_table.indexes:
+            index.create(engine, checkfirst=True)
+    with engine.begin() as conn:
+        # ISO text left from the DateTime column sorts after every INTEGER in SQLite;
+        # the substr drops fractional seconds, truncating like EpochDateTime does
+        conn.execute(text(
+            "UPDATE players SET last_update = CAST(strftime('%s', substr(last_update, 1, 19)) AS INTEGER) "
+            "WHERE typeof(last_update) = 'text'"
+        ))
+    try:
+        with engine.begin() as conn:
+            create_search_indexes(conn)
+        _search_indexes_ready = True
+    except OperationalError as e:
+        _search_indexes_ready = False
+        logging.warning(f"Name search indexes unavailable, falling back to table scans: {e}")
     return engine
@@ -1,9 +1,9 @@
 # main.py
 import logging
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import sessionmaker, scoped_session
 from database import init_db
 from parser import process_reports
-from queries import execute_query, list_queries, confirm_exit
+from queries import execute_query, list_queries, confirm_exit, clear_lookup_caches
 import sys
 
 def setup_logging():
@@ -28,6 +28,7 @@ def update_reports(session):
             input_urls.append(url.strip())
     if input_urls:
         process_reports(input_urls, session)
+        clear_lookup_caches()
     else:
         print("No URLs entered.")
 
@@ -46,24 +47,28 @@ def main():
 
     # Initialize the database and create a session
     engine = init_db()
-    Session = sessionmaker(bind=engine)
+    Session = scoped_session(sessionmaker(bind=engine))
     session = Session()
 
-    while True:
-        main_menu()
-        choice = input("Select an option (1-3): ").strip().lower()
-        if choice == '1':
-            update_reports(session)
-        elif choice == '2':
-            perform_queries(session)
-        elif choice in ['3', 'e', 'exit']:
-            confirm_exit()
-            # If exit is confirmed, sys.exit is called within confirm_exit
-        else:
-            print("Invalid choice. Please select a valid option.")
-
-    # Close the session (unreachable code if sys.exit is called)
-    session.close()
+    try:
+        while True:
+            main_menu()
+            choice = input("Select an option (1-3): ").strip().lower()
+            if choice == '1':
+                update_reports(session)
+            elif choice == '2':
+                perform_queries(session)
+            elif choice in ['3', 'e', 'exit']:
+                confirm_exit()
+                # If exit is confirmed, confirm_exit raises SystemExit
+            else:
+                print("Invalid choice. Please select a valid option.")
+            # Release the objects loaded by this menu action
+            session.expunge_all()
+    finally:
+        # Runs on SystemExit from confirm_exit as well
+        Session.remove()
+        engine.dispose()
 
 if __name__ == "__main__":
     main()
@@ -1,15 +1,91 @@
 # parser.py
-import requests
+import requests_cache
 from bs4 import BeautifulSoup
 import re
+from sqlalchemy import func, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.orm import sessionmaker
 from database import Player, Alliance, Planet, Resource, Building, Research
 from datetime import datetime, timezone
 import logging
-import time
+import hashlib
+import shelve
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# Concurrent report downloads; also bounds the load put on the report server
+FETCH_WORKERS = 8
+FETCH_TIMEOUT = 10
+# Downloads started ahead of the one being processed; bounds report bodies held in memory
+FETCH_WINDOW = 2 * FETCH_WORKERS
+
+# Patterns used while walking the report, compiled once at import
+PLANET_NAME_COORDS_RE = re.compile(r'"(.*?)\s*-\s*(\d+)x(\d+)x(\d+)"')
+COORDS_RE = re.compile(r'(\d+)x(\d+)x(\d+)')
+LEADING_INT_RE = re.compile(r'(\d+)')
+NAME_LEVEL_RE = re.compile(r"(.+)\s(\d+)$")
+RESOURCE_AMOUNT_RE = re.compile(r'([^(]*)(?:\(([^)]*)\)?)?')
+COMMA_TO_DOT = str.maketrans(',', '.')
+
+# On-disk caches so re-ingesting an unchanged report skips the download and the parse
+HTTP_CACHE_NAME = 'xwspio_http'
+HTTP_CACHE_EXPIRE = 3600  # seconds
+PARSE_CACHE_FILE = 'report_cache'
+PARSE_CACHE_VERSION = 2  # Bump whenever parse_espionage_report output changes
+
+# Rows per multi-row upsert; keeps well under SQLite's bound-parameter limit
+INSERT_BATCH_SIZE = 100
+
+def chunked(rows, size):
+    """
+    Yields successive slices of at most `size` rows.
+    """
+    for start in range(0, len(rows), size):
+        yield rows[start:start + size]
+
+def to_float(value):
+    """
+    Converts a parsed resource amount to float, defaulting to 0.0.
+    """
+    try:
+        return float(value)
+    except ValueError:
+        return 0.0
+
+def upsert(session, model, values, index_elements, update_columns=()):
+    """
+    Inserts one row, or updates `update_columns` of the row it conflicts with on
+    `index_elements`, in a single INSERT ... ON CONFLICT statement. Returns the row id,
+    looked up by the conflict key since RETURNING needs SQLite 3.35+.
+    """
+    stmt = sqlite_insert(model).values(**values)
+    if update_columns:
+        stmt = stmt.on_conflict_do_update(
+            index_elements=index_elements,
+            set_={column: stmt.excluded[column] for column in update_columns}
+        )
+    else:
+        stmt = stmt.on_conflict_do_nothing(index_elements=index_elements)
+    session.execute(stmt)
+    key = [getattr(model, column) == values[column] for column in index_elements]
+    return session.execute(select(model.id).where(*key)).scalar_one()
+
+def bulk_upsert(session, model, rows, index_elements, update_columns=(), set_=None):
+    """
+    Upserts a list of row dicts with one multi-row INSERT ... ON CONFLICT per chunk.
+    Conflicting rows get `update_columns` copied from the new values, or the
+    assignments returned by `set_(excluded)` when given.
+    """
+    for chunk in chunked(rows, INSERT_BATCH_SIZE):
+        stmt = sqlite_insert(model).values(chunk)
+        if set_ is not None:
+            assignments = set_(stmt.excluded)
+        else:
+            assignments = {column: stmt.excluded[column] for column in update_columns}
+        session.execute(stmt.on_conflict_do_update(index_elements=index_elements, set_=assignments))
 
 def parse_espionage_report(content):
-    soup = BeautifulSoup(content, 'html.parser')
+    soup = BeautifulSoup(content, 'lxml')
     report_data = {
         "planet_info": {},
         "player_details": {},
@@ -23,7 +99,7 @@ def parse_espionage_report(content):
     if planet_info:
         planet_text = planet_info.get_text(strip=True).replace("Planet information ", "")
         # Use regex to extract name and coordinates
-        match = re.match(r'"(.*?)\s*-\s*(\d+)x(\d+)x(\d+)"', planet_text)
+        match = PLANET_NAME_COORDS_RE.match(planet_text)
         if match:
             name, x, y, z = match.groups()
             report_data["planet_info"]["name"] = name.strip() if name else "Unnamed"
@@ -34,7 +110,7 @@ def parse_espionage_report(content):
         else:
             # If the regex doesn't match, store the whole text as coordinates
             report_data["planet_info"]["name"] = "Unnamed"
-            coord_match = re.match(r'(\d+)x(\d+)x(\d+)', planet_text.strip('"'))
+            coord_match = COORDS_RE.match(planet_text.strip('"'))
             if coord_match:
                 x, y, z = coord_match.groups()
                 report_data["planet_info"]["coordinates"] = f"{x}x{y}x{z}"
@@ -65,7 +141,7 @@ def parse_espionage_report(content):
             elif key in ['temperature', 'planet type', 'attack', 'defense', 'invasion protection']:
                 if key in ['attack', 'defense']:
                     # Extract only the numeric part before any non-digit characters
-                    numeric_value = re.match(r'(\d+)', value)
+                    numeric_value = LEADING_INT_RE.match(value)
                     if numeric_value:
                         report_data["planet_info"][key] = int(numeric_value.group(1))
                     else:
@@ -73,17 +149,12 @@ def parse_espionage_report(content):
                 else:
                     report_data["planet_info"][key] = value
             elif key in ['pig-iron', 'crystals', 'frubin', 'orizin', 'frurozin', 'gold']:
-                if '(' in value:
-                    total, raidable = value.split('(')
-                    report_data["resources"][key] = {
-                        "total": total.strip().replace(',', '.'),  # Ensure float conversion later
-                        "raidable": raidable.replace(')', '').strip().replace(',', '.')  # Ensure float conversion later
-                    }
-                else:
-                    report_data["resources"][key] = {
-                        "total": value.strip().replace(',', '.'),  # Ensure float conversion later
-                        "raidable": "0"
-                    }
+                # "total (raidable)" or just "total", split in one pass
+                total, raidable = RESOURCE_AMOUNT_RE.match(value).groups()
+                report_data["resources"][key] = {
+                    "total": total.strip().translate(COMMA_TO_DOT),  # Ensure float conversion later
+                    "raidable": raidable.strip().translate(COMMA_TO_DOT) if raidable is not None else "0"
+                }
 
     # Find the tables containing buildings and researches
     tables = soup.find_all('table', attrs={'border': '0', 'cellspacing': '1', 'cellpadding': '0', 'width': '100%', 'colspan': '2'})
@@ -93,7 +164,7 @@ def parse_espionage_report(content):
         buildings_table = tables[0]
         for row in buildings_table.find_all('td', class_=['first', 'second']):
             building_info = row.get_text(strip=True)
-            match = re.match(r"(.+)\s(\d+)$", building_info)
+            match = NAME_LEVEL_RE.match(building_info)
             if match:
                 building_name, building_level = match.groups()
                 report_data["buildings"][building_name.strip()] = int(building_level)
@@ -102,149 +173,130 @@ def parse_espionage_report(content):
         researches_table = tables[1]
         for row in researches_table.find_all('td', class_=['first', 'second']):
             research_info = row.get_text(strip=True)
-            match = re.match(r"(.+)\s(\d+)$", research_info)
+            match = NAME_LEVEL_RE.match(research_info)
             if match:
                 research_name, research_level = match.groups()
                 report_data["researches"][research_name.strip()] = int(research_level)
 
     return report_data
 
-def process_reports(urls, session):
+def parse_report_cached(content, parse_cache):
+    """
+    Returns the parsed report for `content`, reusing an earlier parse of identical content.
+    """
+    key = f"{PARSE_CACHE_VERSION}:{hashlib.sha1(content).hexdigest()}"
+    report = parse_cache.get(key)
+    if report is None:
+        report = parse_espionage_report(content)
+        parse_cache[key] = report
+    return report
+
+def fetch_reports(http, executor, urls):
+    """
+    Yields (url, future) pairs in input order, keeping at most FETCH_WINDOW
+    downloads in flight or waiting so finished bodies do not pile up in memory.
+    """
+    pending = deque()
     for url in urls:
-        try:
-            response = requests.get(url)
-            if response.status_code != 200:
-                logging.warning(f"Failed to retrieve {url}: Status code {response.status_code}")
-                continue
-
-            report = parse_espionage_report(response.content)
-            player_name = report["player_details"].get("owner", "Unknown")
-            race = report["player_details"].get("race", "Unknown")
-            alliance_name = report["player_details"].get("alliance", "None")
-
-            # Get or create Alliance
-            if alliance_name != "None":
-                alliance = session.query(Alliance).filter_by(name=alliance_name).first()
-                if not alliance:
-                    alliance = Alliance(name=alliance_name)
-                    session.add(alliance)
-                    session.commit()
-            else:
-                alliance = None  # Correctly handle players without alliances
-
-            # Get or create Player
-            player = session.query(Player).filter_by(name=player_name).first()
-            if not player:
-                player = Player(
-                    name=player_name,
-                    race=race,
-                    alliance=alliance,
-                    last_update=datetime.now(timezone.utc)  # Updated here
-                )
-                session.add(player)
-                session.commit()
-            else:
-                # Update existing player
-                player.race = race
-                player.alliance = alliance
-                player.last_update = datetime.now(timezone.utc)  # Updated here
-                session.commit()
+        pending.append((url, executor.submit(http.get, url, timeout=FETCH_TIMEOUT)))
+        if len(pending) >= FETCH_WINDOW:
+            yield pending.popleft()
+    while pending:
+        yield pending.popleft()
 
-            # Get or create Planet
-            coordinates = report["planet_info"].get("coordinates", "Unknown")
-            planet = session.query(Planet).filter_by(coordinates=coordinates).first()
-            if not planet:
-                planet = Planet(
-                    name=report["planet_info"].get("name", "Unknown"),
-                    coordinates=coordinates,
-                    x_coord=report["planet_info"].get("x_coord", 0),
-                    y_coord=report["planet_info"].get("y_coord", 0),
-                    z_coord=report["planet_info"].get("z_coord", 0),
-                    temperature=report["planet_info"].get("temperature", "Unknown"),
-                    planet_type=report["planet_info"].get("planet type", "Unknown"),
-                    attack=report["planet_info"].get("attack", 0),  # Already an integer
-                    defense=report["planet_info"].get("defense", 0),  # Already an integer
-                    invasion_protection=report["planet_info"].get("invasion protection", "Unknown"),
-                    player=player
-                )
-                session.add(planet)
-                session.commit()
-            else:
-                # Update existing planet
-                planet.name = report["planet_info"].get("name", "Unknown")
-                planet.coordinates = coordinates
-                planet.x_coord = report["planet_info"].get("x_coord", 0)
-                planet.y_coord = report["planet_info"].get("y_coord", 0)
-                planet.z_coord = report["planet_info"].get("z_coord", 0)
-                planet.temperature = report["planet_info"].get("temperature", "Unknown")
-                planet.planet_type = report["planet_info"].get("planet type", "Unknown")
-                planet.attack = report["planet_info"].get("attack", 0)
-                planet.defense = report["planet_info"].get("defense", 0)
-                planet.invasion_protection = report["planet_info"].get("invasion protection", "Unknown")
-                session.commit()
+def process_reports(urls, session):
+    # Fetch concurrently over pooled connections; parsing and DB writes stay on this thread
+    with requests_cache.CachedSession(HTTP_CACHE_NAME, expire_after=HTTP_CACHE_EXPIRE) as http, \
+            ThreadPoolExecutor(max_workers=FETCH_WORKERS) as executor, \
+            shelve.open(PARSE_CACHE_FILE) as parse_cache:
+        # One timestamp for the whole batch
+        now = datetime.now(timezone.utc)
 
-            # Update Resources
-            for res_type, res_values in report["resources"].items():
-                resource = session.query(Resource).filter_by(type=res_type, planet=planet).first()
-                if not resource:
-                    try:
-                        total = float(res_values["total"])
-                    except ValueError:
-                        total = 0.0
-                    try:
-                        raidable = float(res_values["raidable"])
-                    except ValueError:
-                        raidable = 0.0
-                    resource = Resource(
-                        type=res_type,
-                        total=total,
-                        raidable=raidable,
-                        planet=planet
-                    )
-                    session.add(resource)
-                else:
-                    try:
-                        resource.total = float(res_values["total"])
-                    except ValueError:
-                        resource.total = 0.0
-                    try:
-                        resource.raidable = float(res_values["raidable"])
-                    except ValueError:
-                        resource.raidable = 0.0
-                session.commit()
+        for url, future in fetch_reports(http, executor, urls):
+            try:
+                response = future.result()
+                if response.status_code != 200:
+                    logging.warning(f"Failed to retrieve {url}: Status code {response.status_code}")
+                    continue
 
-            # Update Buildings
-            for building_name, building_level in report["buildings"].items():
-                building = session.query(Building).filter_by(name=building_name, planet=planet).first()
-                if not building:
-                    building = Building(
-                        name=building_name,
-                        level=building_level,
-                        planet=planet
-                    )
-                    session.add(building)
-                else:
-                    building.level = building_level
-                session.commit()
+                report = parse_report_cached(response.content, parse_cache)
+                player_name = report["player_details"].get("owner", "Unknown")
+                race = report["player_details"].get("race", "Unknown")
+                alliance_name = report["player_details"].get("alliance", "None")
 
-            # Update Researches (shared per player)
-            for research_name, research_level in report["researches"].items():
-                research = session.query(Research).filter_by(name=research_name, player=player).first()
-                if not research:
-                    research = Research(
-                        name=research_name,
-                        level=research_level,
-                        player=player
-                    )
-                    session.add(research)
+                # Upsert Alliance
+                if alliance_name != "None":
+                    alliance_id = upsert(session, Alliance, {"name": alliance_name}, ["name"])
                 else:
-                    if research_level > research.level:
-                        research.level = research_level
-                session.commit()
+                    alliance_id = None  # Correctly handle players without alliances
 
-            logging.info(f"Processed report from {player_name} at {coordinates}")
+                # Upsert Player
+                player_id = upsert(
+                    session, Player,
+                    {
+                        "name": player_name,
+                        "race": race,
+                        "alliance_id": alliance_id,
+                        "last_update": now
+                    },
+                    ["name"], ["race", "alliance_id", "last_update"]
+                )
+
+                # Upsert Planet (an existing planet keeps its owner)
+                coordinates = report["planet_info"].get("coordinates", "Unknown")
+                planet_id = upsert(
+                    session, Planet,
+                    {
+                        "name": report["planet_info"].get("name", "Unknown"),
+                        "coordinates": coordinates,
+                        "x_coord": report["planet_info"].get("x_coord", 0),
+                        "y_coord": report["planet_info"].get("y_coord", 0),
+                        "z_coord": report["planet_info"].get("z_coord", 0),
+                        "temperature": report["planet_info"].get("temperature", "Unknown"),
+                        "planet_type": report["planet_info"].get("planet type", "Unknown"),
+                        "attack": report["planet_info"].get("attack", 0),  # Already an integer
+                        "defense": report["planet_info"].get("defense", 0),  # Already an integer
+                        "invasion_protection": report["planet_info"].get("invasion protection", "Unknown"),
+                        "player_id": player_id
+                    },
+                    ["coordinates"],
+                    ["name", "x_coord", "y_coord", "z_coord", "temperature", "planet_type",
+                     "attack", "defense", "invasion_protection"]
+                )
+
+                # Upsert Resources
+                resources = [
+                    {
+                        "type": res_type,
+                        "total": to_float(res_values["total"]),
+                        "raidable": to_float(res_values["raidable"]),
+                        "planet_id": planet_id
+                    }
+                    for res_type, res_values in report["resources"].items()
+                ]
+                bulk_upsert(session, Resource, resources, ["planet_id", "type"], ["total", "raidable"])
 
-            time.sleep(1)  # Sleep to prevent overwhelming the server
+                # Upsert Buildings
+                buildings = [
+                    {"name": building_name, "level": building_level, "planet_id": planet_id}
+                    for building_name, building_level in report["buildings"].items()
+                ]
+                bulk_upsert(session, Building, buildings, ["planet_id", "name"], ["level"])
+
+                # Upsert Researches (shared per player, a level never goes down)
+                researches = [
+                    {"name": research_name, "level": research_level, "player_id": player_id}
+                    for research_name, research_level in report["researches"].items()
+                ]
+                bulk_upsert(
+                    session, Research, researches, ["player_id", "name"],
+                    set_=lambda excluded: {"level": func.max(Research.level, excluded.level)}
+                )
+
+                # Commit the whole report in a single transaction
+                session.commit()
+                logging.info(f"Processed report from {player_name} at {coordinates}")
 
-        except Exception as e:
-            logging.error(f"Error processing {url}: {e}")
+            except Exception as e:
+                session.rollback()
+                logging.error(f"Error processing {url}: {e}")
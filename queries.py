@@ -1,78 +1,134 @@
 # queries.py
 import json
+import csv
+from collections import defaultdict
+from itertools import chain, islice
 from sqlalchemy.orm import sessionmaker
-from database import init_db, Player, Planet, Resource, Research, Alliance, Building
-from sqlalchemy import desc, func
+from database import init_db, Player, Planet, Resource, Research, Alliance, Building, player_search, alliance_search, search_indexes_available
+from sqlalchemy import select, desc, func, exists, case, bindparam
 import logging
-from tabulate import tabulate
-import pandas as pd
 import sys
+import time
+from tabulate import tabulate
+import numpy as np
+
+try:
+    # Optional: needed for Feather/Parquet exports
+    import pyarrow
+    import pyarrow.feather
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
 
 SETTINGS_FILE = 'settings.json'
+# Rows handed to the CSV writer at a time, so streamed exports stay memory-bounded
+EXPORT_CHUNK_ROWS = 10_000
+# Export formats by file extension; Feather is the default unless changed in Settings
+EXPORT_FORMATS = {'feather': 'Feather', 'parquet': 'Parquet', 'csv': 'CSV'}
+DEFAULT_EXPORT_FORMAT = 'feather'
+# Shortest search term the trigram FTS indexes can answer
+TRIGRAM_MIN_LENGTH = 3
+_settings_cache = None  # Last settings read or written; see load_settings
+
+# Menu lookups built once so every call hits the engine's compiled-statement cache
+RESOURCE_TYPES_STMT = select(Resource.type).distinct()
+BUILDING_NAMES_STMT = select(Building.name).distinct()
+RESEARCH_NAMES_STMT = select(Research.name).distinct()
+PLAYER_NAMES_STMT = select(Player.name).distinct()
+
+# Navigation commands accepted at the menu and selection prompts
+_NAV = {'b': 'back', 'back': 'back', 'e': 'exit', 'exit': 'exit', '0': 'cancel'}
+# Answers to y/N prompts; empty input takes the prompt's default
+_YES = frozenset({'y', 'yes'})
+_NO = frozenset({'n', 'no'})
+
+# Unique-value lookups keyed by (engine, statement) -> (expiry, values). Cleared after
+# every ingest; the TTL also picks up rows written by another process.
+LOOKUP_CACHE_TTL = 300  # seconds
+_lookup_cache = {}
 
 def load_settings():
     """
     Loads the settings from the SETTINGS_FILE.
     If the file does not exist, returns default settings.
+    The file is only read once; later calls return a copy of the cached settings.
     """
-    try:
-        with open(SETTINGS_FILE, 'r') as f:
-            settings = json.load(f)
-    except FileNotFoundError:
-        settings = {"user_player": None}
-        save_settings(settings)
-    return settings
+    global _settings_cache
+    if _settings_cache is None:
+        try:
+            with open(SETTINGS_FILE, 'r') as f:
+                _settings_cache = json.load(f)
+        except FileNotFoundError:
+            save_settings({"user_player": None})
+    return dict(_settings_cache)
 
 def save_settings(settings):
     """
-    Saves the settings to the SETTINGS_FILE.
+    Saves the settings to the SETTINGS_FILE and refreshes the cached copy.
     """
+    global _settings_cache
     with open(SETTINGS_FILE, 'w') as f:
-        json.dump(settings, f, indent=4)
+        f.write(json.dumps(settings, indent=4))
+    _settings_cache = dict(settings)
+
+def clear_lookup_caches():
+    """
+    Drops the cached unique-value lookups. Call after new reports are stored.
+    """
+    _lookup_cache.clear()
+
+def _unique(session, stmt):
+    key = (session.get_bind(), stmt)
+    now = time.monotonic()
+    cached = _lookup_cache.get(key)
+    if cached is None or cached[0] <= now:
+        cached = (now + LOOKUP_CACHE_TTL, tuple(session.execute(stmt).scalars().all()))
+        _lookup_cache[key] = cached
+    return cached[1]
 
 def get_unique_resources(session):
-    return session.query(Resource.type).distinct().all()
+    return list(_unique(session, RESOURCE_TYPES_STMT))
 
 def get_unique_buildings(session):
-    return session.query(Building.name).distinct().all()
+    return list(_unique(session, BUILDING_NAMES_STMT))
 
 def get_unique_researches(session):
-    return session.query(Research.name).distinct().all()
+    return list(_unique(session, RESEARCH_NAMES_STMT))
+
+def get_unique_players(session):
+    return list(_unique(session, PLAYER_NAMES_STMT))
 
 def display_options(options, option_type):
     print(f"\nAvailable {option_type}:")
-    for idx, (option,) in enumerate(options, start=1):
+    for idx, option in enumerate(options, start=1):
         print(f"{idx}. {option}")
     print("0. Cancel")
 
 def get_user_selection(options, option_type):
+    # Lowercase the option names once, not on every attempt
+    lowered = [option.lower() for option in options]
     while True:
         display_options(options, option_type)
         print("Type 'b' or 'back' to go back.")
         print("Type 'e' or 'exit' to exit the program.")
         selection = input(f"Select a {option_type[:-1]} by number or name (0 to cancel): ").strip().lower()
 
-        if selection in ['b', 'back']:
+        action = _NAV.get(selection)
+        if action == 'back':
             print("\nGoing back...")
             return None
-
-        if selection in ['e', 'exit']:
+        elif action == 'exit':
             confirm_exit()
             return None  # This line won't be reached if exit is confirmed
-
-        if selection == '0':
+        elif action == 'cancel':
             return None
 
         # Try to interpret as a number
-        if selection.isdigit():
+        try:
             index = int(selection) - 1
-            if 0 <= index < len(options):
-                return options[index][0]
-            else:
-                print("Invalid number selection. Please try again.")
-        else:
+        except ValueError:
             # Attempt case-insensitive partial match
-            matches = [option[0] for option in options if selection in option[0].lower()]
+            matches = [options[i] for i, name in enumerate(lowered) if selection in name]
             if len(matches) == 1:
                 return matches[0]
             elif len(matches) > 1:
@@ -82,37 +138,125 @@ def get_user_selection(options, option_type):
                 print("Please be more specific.")
             else:
                 print("No matches found. Please try again.")
+        else:
+            if 0 <= index < len(options):
+                return options[index]
+            else:
+                print("Invalid number selection. Please try again.")
+
+def _fast_table(rows, headers):
+    """
+    Renders rows like tabulate's "pretty" format (centered cells, None as blank)
+    in a single formatting pass over the cells. Returns None if any cell is not
+    printable ASCII: len() does not give the display width of wide characters,
+    and tabs/newlines need tabulate's layout.
+    """
+    cells = [[str(headers[i]) for i in range(len(headers))]]
+    cells += [['' if cell is None else str(cell).strip() for cell in row] for row in rows]
+    if not all(cell.isascii() and cell.isprintable() for cell in chain.from_iterable(cells)):
+        return None
+    widths = [max(map(len, column)) for column in zip(*cells)]
+
+    def render(row):
+        parts = []
+        for cell, width in zip(row, widths):
+            left = (width - len(cell)) // 2
+            parts.append(' ' * left + cell + ' ' * (width - len(cell) - left))
+        return '| ' + ' | '.join(parts) + ' |'
+
+    border = '+' + '+'.join('-' * (width + 2) for width in widths) + '+'
+    return '\n'.join([border, render(cells[0]), border, *map(render, cells[1:]), border])
+
+def format_table(rows, headers):
+    """
+    Formats query results as a "pretty" table. Plain ASCII tables are rendered by
+    _fast_table; tabulate handles the rest with its Unicode width support.
+    """
+    table = _fast_table(rows, headers)
+    if table is None:
+        table = tabulate(rows, headers=headers, tablefmt="pretty")
+    return table
+
+def _confirm(prompt, default=False):
+    """
+    Asks a yes/no question until answered; empty input returns `default`.
+    """
+    while True:
+        answer = input(prompt).strip().lower()
+        if answer in _YES:
+            return True
+        if answer in _NO:
+            return False
+        if not answer:
+            return default
+        print("Invalid input. Please enter 'y' or 'n'.")
+
+def _prompt_filename():
+    while True:
+        filename = input("Enter the filename (without extension): ").strip()
+        if filename:
+            return filename
+        print("Filename cannot be empty. Please try again.")
+
+def write_csv(filename, columns, rows):
+    """
+    Writes the header and rows to `filename` through one large write buffer.
+    `rows` may be any iterable, e.g. a streamed result; it is consumed in chunks.
+    """
+    rows = iter(rows)
+    with open(filename, 'w', newline='', buffering=1 << 20) as f:
+        writer = csv.writer(f, lineterminator='\n')
+        writer.writerow(columns)
+        for chunk in iter(lambda: list(islice(rows, EXPORT_CHUNK_ROWS)), []):
+            writer.writerows(chunk)
+
+def get_export_format():
+    """
+    Returns the export format chosen in the Settings menu.
+    """
+    export_format = load_settings().get("export_format", DEFAULT_EXPORT_FORMAT)
+    return export_format if export_format in EXPORT_FORMATS else DEFAULT_EXPORT_FORMAT
+
+def write_export(filename, columns, rows, export_format):
+    """
+    Writes the rows to `filename` plus the format's extension and returns the path written.
+    Feather/Parquet fall back to CSV when pyarrow is not installed.
+    """
+    if export_format != 'csv' and pyarrow is None:
+        print(f"{EXPORT_FORMATS[export_format]} export needs pyarrow; writing CSV instead.")
+        export_format = 'csv'
+    path = f"{filename}.{export_format}"
+    if export_format == 'csv':
+        write_csv(path, columns, rows)
+    else:
+        # Rows go straight into Arrow columns; no DataFrame copy in between
+        rows = list(rows)
+        data = pyarrow.table({name: [row[i] for row in rows] for i, name in enumerate(columns)})
+        if export_format == 'feather':
+            pyarrow.feather.write_feather(data, path)
+        else:
+            pyarrow.parquet.write_table(data, path, compression='zstd')
+    return path
 
 def export_results(results, columns):
     """
-    Prompts the user to export results to a CSV file.
+    Prompts the user to export results to a file in the configured export format.
 
     Parameters:
     - results: List of tuples containing the query results.
     - columns: List of column names corresponding to the results.
     """
-    while True:
-        export = input("Do you want to export the results to CSV? (y/N): ").strip().lower()
-        if export == 'y':
-            df = pd.DataFrame(results, columns=columns)
-            while True:
-                filename = input("Enter the filename (without extension): ").strip()
-                if filename:
-                    break
-                else:
-                    print("Filename cannot be empty. Please try again.")
-            try:
-                df.to_csv(f"{filename}.csv", index=False)
-                print(f"Results exported to {filename}.csv")
-                break
-            except Exception as e:
-                print(f"Failed to export results: {e}")
-                # Optionally, ask if the user wants to retry
-        elif export == 'n' or export == '':
-            # Default is 'No'
+    results = list(results)  # A retry after a failed write needs the rows again
+    export_format = get_export_format()
+    # A failed write asks again, so the user can retry or give up
+    while _confirm(f"Do you want to export the results to {EXPORT_FORMATS[export_format]}? (y/N): "):
+        filename = _prompt_filename()
+        try:
+            path = write_export(filename, columns, results, export_format)
+            print(f"Results exported to {path}")
             break
-        else:
-            print("Invalid input. Please enter 'y' or 'n'.")
+        except Exception as e:
+            print(f"Failed to export results: {e}")
 
 def get_total_raidable_resources(session):
     """
@@ -123,91 +267,151 @@ def get_total_raidable_resources(session):
         total_raidable (float): The sum of raidable resources.
         individual_resources (list of tuples): Each tuple contains (Resource Type, Raidable Amount).
     """
-    total = session.query(func.sum(Resource.raidable)).scalar() or 0.0
+    individual = session.execute(
+        select(Resource.type, func.sum(Resource.raidable)).group_by(Resource.type)
+    ).all()
+    # The grand total is the sum of the per-type sums, no second scan needed
+    total = sum(raidable_amount or 0.0 for _, raidable_amount in individual)
     logging.info(f"Total Raidable Resources: {total}")
 
-    individual = session.query(Resource.type, func.sum(Resource.raidable)) \
-                        .group_by(Resource.type).all()
     for resource_type, raidable_amount in individual:
         logging.info(f"Resource: {resource_type}, Raidable Amount: {raidable_amount}")
 
     return total, individual
 
+# Top-N statements with the filter value and limit as bind parameters: the same SQL
+# string every call, so it is compiled once and reused from the driver's statement cache
+MOST_RAIDABLE_STMT = select(
+    Player.name,
+    func.sum(Resource.raidable).label('total_raidable')
+).join(Player.planets).join(Planet.resources).where(
+    Resource.type == bindparam('resource_type')
+).group_by(Player.id).order_by(desc('total_raidable')).limit(bindparam('limit'))
+
+HIGHEST_RESEARCH_STMT = select(
+    Player.name,
+    Research.level
+).join(Player.researches).where(
+    Research.name == bindparam('research_name')
+).order_by(desc(Research.level)).limit(bindparam('limit'))
+
+HIGHEST_BUILDING_STMT = select(
+    Player.name,
+    func.max(Building.level).label('max_level')
+).join(Player.planets).join(Planet.buildings).where(
+    Building.name == bindparam('building_name')
+).group_by(Player.id).order_by(desc('max_level')).limit(bindparam('limit'))
+
 def get_players_with_most_raidable_resources(session, resource_type, limit=10):
-    results = session.query(
-        Player.name,
-        func.sum(Resource.raidable).label('total_raidable')
-    ).join(Player.planets).join(Planet.resources).filter(
-        Resource.type == resource_type
-    ).group_by(Player.id).order_by(desc('total_raidable')).limit(limit).all()
-    return results
+    return session.execute(MOST_RAIDABLE_STMT, {'resource_type': resource_type, 'limit': limit}).all()
 
 def get_players_with_highest_research(session, research_name, limit=10):
-    results = session.query(
-        Player.name,
-        Research.level
-    ).join(Player.researches).filter(
-        Research.name == research_name
-    ).order_by(desc(Research.level)).limit(limit).all()
-    return results
+    return session.execute(HIGHEST_RESEARCH_STMT, {'research_name': research_name, 'limit': limit}).all()
 
 def get_players_with_highest_building_level(session, building_name, limit=10):
-    results = session.query(
-        Player.name,
-        func.max(Building.level).label('max_level')
-    ).join(Player.planets).join(Planet.buildings).filter(
-        Building.name == building_name
-    ).group_by(Player.id).order_by(desc('max_level')).limit(limit).all()
-    return results
+    return session.execute(HIGHEST_BUILDING_STMT, {'building_name': building_name, 'limit': limit}).all()
 
 def search_players(session, player_name=None, alliance_name=None):
-    query = session.query(Player)
+    """
+    Searches players by partial name and/or alliance name.
+
+    Returns:
+        players (list of rows): Each row contains (Player Name, Race, Alliance, Last Update),
+        with 'None' as the alliance of unaffiliated players.
+    """
+    stmt = select(
+        Player.name,
+        Player.race,
+        func.coalesce(Alliance.name, 'None').label('alliance'),
+        Player.last_update
+    ).outerjoin(Player.alliance)
+    # Substring matches come from the trigram FTS indexes; their LIKE is case-insensitive.
+    # Terms shorter than a trigram can't use the index (and miss non-ASCII names), and
+    # without the indexes (SQLite < 3.34) the names are scanned with ILIKE instead.
+    use_index = search_indexes_available()
     if player_name:
-        query = query.filter(Player.name.ilike(f"%{player_name}%"))
+        if use_index and len(player_name) >= TRIGRAM_MIN_LENGTH:
+            stmt = stmt.where(Player.id.in_(
+                select(player_search.c.rowid).where(player_search.c.name.like(f"%{player_name}%"))
+            ))
+        else:
+            stmt = stmt.where(Player.name.ilike(f"%{player_name}%"))
     if alliance_name:
-        query = query.join(Player.alliance).filter(Alliance.name.ilike(f"%{alliance_name}%"))
-    return query.all()
+        if use_index and len(alliance_name) >= TRIGRAM_MIN_LENGTH:
+            stmt = stmt.where(Player.alliance_id.in_(
+                select(alliance_search.c.rowid).where(alliance_search.c.name.like(f"%{alliance_name}%"))
+            ))
+        else:
+            stmt = stmt.where(Alliance.name.ilike(f"%{alliance_name}%"))
+    return session.execute(stmt).all()
+
+# players.name is unique, so this is a single seek on its unique index
+NEWEST_UPDATE_STMT = select(Player.last_update).where(Player.name == bindparam('player_name'))
 
 def get_newest_update_for_player(session, player_name):
-    player = session.query(Player).filter(Player.name == player_name).first()
-    if player:
-        return player.last_update
-    return None
+    return session.execute(NEWEST_UPDATE_STMT, {'player_name': player_name}).scalar_one_or_none()
 
-def get_player_planets_and_resources(session, player_name):
+def get_research_levels_by_player(session, *criteria):
     """
-    Retrieves planets and their resources for a given player.
+    Retrieves the research levels of every player matching `criteria` in one query.
+    Players without any research are included with an empty dict.
 
     Returns:
-        planets_resources (list of tuples): Each tuple contains (Coordinates, Planet Type, Resource Type, Raidable Amount)
+        by_player (dict): Maps Player Name to a {Research Name: Level} dict.
+    """
+    stmt = select(Player.name, Research.name, Research.level) \
+        .outerjoin(Player.researches).where(*criteria).order_by(Player.id)
+    by_player = defaultdict(dict)
+    for player_name, research_name, level in session.execute(stmt):
+        levels = by_player[player_name]
+        if research_name is not None:
+            levels[research_name] = level
+    return by_player
+
+def get_research_comparison(session, player_name, other_player_name):
     """
-    planets = session.query(Planet).filter(Planet.player.has(name=player_name)).all()
-    if not planets:
-        return []
-
-    planets_resources = []
-    for planet in planets:
-        coord = f"{planet.x_coord}x{planet.y_coord}x{planet.z_coord}"
-        planet_type = planet.planet_type
-        resources = session.query(Resource.type, Resource.raidable).filter(Resource.planet_id == planet.id).all()
-        for res_type, raidable in resources:
-            planets_resources.append((coord, planet_type, res_type, raidable))
-    return planets_resources
+    Retrieves the research levels of two players side by side, ordered by research name.
+
+    Returns:
+        comparison (list of tuples): Each tuple contains (Research Name, Level of player_name,
+        Level of other_player_name), with 0 where a player lacks the research
+    """
+    stmt = select(
+        Research.name,
+        func.max(case((Player.name == player_name, Research.level), else_=0)),
+        func.max(case((Player.name == other_player_name, Research.level), else_=0))
+    ).join(Research.player).where(
+        Player.name.in_([player_name, other_player_name])
+    ).group_by(Research.name).order_by(Research.name)
+    return [tuple(row) for row in session.execute(stmt)]
+
+def get_player_resource_table(session, player_name, resource_types):
+    """
+    Retrieves a player's planets with their raidable amounts already pivoted by resource type.
+
+    Returns:
+        rows (list of tuples): Each tuple contains (Coordinates, Planet Type, *Raidable Amount per
+        entry of resource_types), with 0.0 for a type the planet has no row for
+    """
+    stmt = select(
+        Planet.x_coord, Planet.y_coord, Planet.z_coord, Planet.planet_type,
+        *[func.sum(case((Resource.type == res_type, Resource.raidable), else_=0.0)) for res_type in resource_types]
+    ).join(Planet.resources).where(
+        Planet.player.has(name=player_name)
+    ).group_by(Planet.id).order_by(Planet.id)
+    return [
+        (f"{x}x{y}x{z}", planet_type, *amounts)
+        for x, y, z, planet_type, *amounts in session.execute(stmt)
+    ]
 
 def confirm_exit():
     """
     Confirms with the user before exiting the program.
     """
-    while True:
-        confirm = input("Are you sure you want to exit the program? (y/N): ").strip().lower()
-        if confirm == 'y':
-            print("Exiting the program. Goodbye!")
-            sys.exit(0)
-        elif confirm == 'n' or confirm == '':
-            print("Exit canceled.")
-            break
-        else:
-            print("Invalid input. Please enter 'y' or 'n'.")
+    if _confirm("Are you sure you want to exit the program? (y/N): "):
+        print("Exiting the program. Goodbye!")
+        raise SystemExit(0)  # Lets callers' finally blocks close the session
+    print("Exit canceled.")
 
 def view_player_details(session):
     """
@@ -215,7 +419,7 @@ def view_player_details(session):
     Displays Coordinates, Planet Type, individual resources, sum total per planet,
     and an overall sum total of all resources.
     """
-    players = session.query(Player.name).distinct().all()
+    players = get_unique_players(session)
     if not players:
         print("No players found in the database.")
         return
@@ -224,79 +428,13 @@ def view_player_details(session):
     if not player:
         return  # User chose to go back or cancel
 
-    planets_resources = get_player_planets_and_resources(session, player)
-    if not planets_resources:
-        print(f"No planets found for player '{player}'.")
-        return
-
-    # Organize data per planet
-    planet_dict = {}
-    for coord, planet_type, res_type, raidable in planets_resources:
-        if coord not in planet_dict:
-            planet_dict[coord] = {
-                "Planet Type": planet_type,
-                "Resources": {}
-            }
-        planet_dict[coord]["Resources"][res_type] = raidable
-
-    # Get all unique resource types for headers
-    resource_types = session.query(Resource.type).distinct().all()
-    resource_types = sorted([res[0] for res in resource_types])
-
-    # Prepare table data
-    headers = ["Coordinates", "Planet Type"] + resource_types + ["Total"]
-    table = []
-    grand_total = 0.0
-    for coord, data in planet_dict.items():
-        planet_type = data["Planet Type"]
-        row = [coord, planet_type]
-        total = 0.0
-        for res in resource_types:
-            amount = data["Resources"].get(res, 0.0)
-            row.append(amount)
-            total += amount
-        row.append(total)
-        grand_total += total
-        table.append(row)
-
-    # Append grand total row
-    grand_total_row = ["Grand Total", "", *[""] * len(resource_types), grand_total]
-    table.append(grand_total_row)
-
-    # Display data
-    print(f"\nPlayer: {player}")
-    print("\nPlanets and Their Resources:")
-    print(tabulate(table, headers=headers, tablefmt="pretty"))
-
-    # Export option
-    while True:
-        export = input("Do you want to export the results to CSV? (y/N): ").strip().lower()
-        if export == 'y':
-            # Prepare data for CSV
-            df = pd.DataFrame(table, columns=headers)
-            while True:
-                filename = input("Enter the filename (without extension): ").strip()
-                if filename:
-                    break
-                else:
-                    print("Filename cannot be empty. Please try again.")
-            try:
-                df.to_csv(f"{filename}.csv", index=False)
-                print(f"Results exported to {filename}.csv")
-                break
-            except Exception as e:
-                print(f"Failed to export results: {e}")
-        elif export == 'n' or export == '':
-            # Default is 'No'
-            break
-        else:
-            print("Invalid input. Please enter 'y' or 'n'.")
+    show_player_resources(session, player)
 
 def set_user_player(session):
     """
     Allows the user to set their player name for comparison purposes.
     """
-    players = session.query(Player.name).distinct().all()
+    players = get_unique_players(session)
     if not players:
         print("No players found in the database.")
         return
@@ -310,27 +448,59 @@ def set_user_player(session):
     save_settings(settings)
     print(f"User player set to '{player}'.")
 
-def compare_tech(session):
+def set_export_format():
     """
-    Compares research levels between the user player and a target player.
-    Displays a table comparing each research's level.
+    Lets the user choose the file format used for exports.
+    """
+    export_format = get_user_selection(list(EXPORT_FORMATS), "Export Formats")
+    if not export_format:
+        return  # User chose to go back or cancel
+
+    settings = load_settings()
+    settings["export_format"] = export_format
+    save_settings(settings)
+    print(f"Export format set to {EXPORT_FORMATS[export_format]}.")
+
+def _load_user_context(session, with_researches=True):
+    """
+    Loads the configured user player and their research levels.
+    Returns (user_player row with .id and .name, {research name: level}), or None after telling the user
+    why when no user player is set or it is not in the database.
+    With with_researches=False the researches are not loaded and None is returned in their place.
     """
     settings = load_settings()
     user_player_name = settings.get("user_player")
     if not user_player_name:
         print("User player is not set. Please set it in the Settings menu.")
-        return
+        return None
 
-    # Get user player's researches
-    user_player = session.query(Player).filter(Player.name == user_player_name).first()
+    # Plain column rows; nothing here needs a Player object
+    user_player = session.execute(select(Player.id, Player.name).where(Player.name == user_player_name)).first()
     if not user_player:
         print(f"User player '{user_player_name}' not found in the database.")
-        return
+        return None
 
-    user_researches = {research.name: research.level for research in user_player.researches}
+    if not with_researches:
+        return user_player, None
+    user_researches = dict(session.execute(
+        select(Research.name, Research.level).where(Research.player_id == user_player.id)
+    ).all())
+    return user_player, user_researches
+
+def compare_tech(session):
+    """
+    Compares research levels between the user player and a target player.
+    Displays a table comparing each research's level.
+    """
+    # Both players' researches are compared in one query once the target is known
+    context = _load_user_context(session, with_researches=False)
+    if context is None:
+        return
+    user_player, _ = context
+    user_player_name = user_player.name
 
     # Select target player
-    players = session.query(Player.name).filter(Player.name != user_player_name).distinct().all()
+    players = session.execute(select(Player.name).where(Player.name != user_player_name).distinct()).scalars().all()
     if not players:
         print("No other players found in the database.")
         return
@@ -339,22 +509,12 @@ def compare_tech(session):
     if not target_player:
         return  # User chose to go back or cancel
 
-    target_player_obj = session.query(Player).filter(Player.name == target_player).first()
-    target_researches = {research.name: research.level for research in target_player_obj.researches}
-
-    # Get all unique research names
-    all_researches = set(user_researches.keys()).union(set(target_researches.keys()))
-
-    # Prepare comparison table
-    comparison = []
-    for research in sorted(all_researches):
-        user_level = user_researches.get(research, 0)
-        target_level = target_researches.get(research, 0)
-        comparison.append((research, user_level, target_level))
+    # Comparison table, already merged and sorted by research name in SQL
+    comparison = get_research_comparison(session, user_player_name, target_player)
 
     # Display comparison
     print(f"\nResearch Comparison between '{user_player_name}' and '{target_player}':")
-    table = tabulate(comparison, headers=["Research", f"{user_player_name} Level", f"{target_player} Level"], tablefmt="pretty")
+    table = format_table(comparison, ["Research", f"{user_player_name} Level", f"{target_player} Level"])
     print(table)
 
     # Export option
@@ -364,22 +524,14 @@ def tech_steal_targets(session):
     """
     Picks a target player to steal tech from based on specific criteria.
     """
-    settings = load_settings()
-    user_player_name = settings.get("user_player")
-    if not user_player_name:
-        print("User player is not set. Please set it in the Settings menu.")
-        return
-
-    # Get user player's researches
-    user_player = session.query(Player).filter(Player.name == user_player_name).first()
-    if not user_player:
-        print(f"User player '{user_player_name}' not found in the database.")
+    context = _load_user_context(session)
+    if context is None:
         return
-
-    user_researches = {research.name: research.level for research in user_player.researches}
+    user_player, user_researches = context
+    user_player_name = user_player.name
 
     # Select research to steal
-    researches = session.query(Research.name).distinct().all()
+    researches = get_unique_researches(session)
     if not researches:
         print("No researches found in the database.")
         return
@@ -390,36 +542,37 @@ def tech_steal_targets(session):
 
     selected_research_level = user_researches.get(selected_research, 0) + 1  # Target level to reach
 
-    # Find players who have the selected research at a higher level than the user
-    potential_targets = session.query(Player).join(Player.researches).filter(
+    # Players who have the selected research at a higher level than the user...
+    higher_in_selected = exists().where(
+        Research.player_id == Player.id,
         Research.name == selected_research,
         Research.level >= selected_research_level
-    ).all()
-
-    if not potential_targets:
-        print(f"No players found with '{selected_research}' level >= {selected_research_level}.")
-        return
-
-    # Further filter players who have equal or lower levels in all other researches
-    suitable_targets = []
-    for target in potential_targets:
-        target_researches = {research.name: research.level for research in target.researches}
-        higher_in_selected = target_researches.get(selected_research, 0) >= selected_research_level
-        lower_or_equal_in_others = all(
-            target_researches.get(research, 0) <= user_researches.get(research, 0)
-            for research in user_researches
-            if research != selected_research
-        )
-        if higher_in_selected and lower_or_equal_in_others:
-            suitable_targets.append(target.name)
+    )
+    # ...that are not above the user in any of the user's other researches
+    user_levels = select(Research.name, Research.level).where(
+        Research.player_id == user_player.id,
+        Research.name != selected_research
+    ).cte('user_levels')
+    higher_in_other = exists().where(
+        Research.player_id == Player.id,
+        Research.name == user_levels.c.name,
+        Research.level > user_levels.c.level
+    )
+    suitable_targets = session.execute(
+        select(Player.name).where(higher_in_selected, ~higher_in_other)
+    ).scalars().all()
 
     if not suitable_targets:
-        print(f"No suitable targets found for stealing '{selected_research}'.")
+        # Only now tell apart "nobody is ahead" from "everyone ahead is ahead elsewhere too"
+        if not session.execute(select(higher_in_selected)).scalar():
+            print(f"No players found with '{selected_research}' level >= {selected_research_level}.")
+        else:
+            print(f"No suitable targets found for stealing '{selected_research}'.")
         return
 
     # Display suitable targets
     print(f"\nSuitable Targets for Stealing '{selected_research}':")
-    table = tabulate([(name,) for name in suitable_targets], headers=["Player Name"], tablefmt="pretty")
+    table = format_table([(name,) for name in suitable_targets], ["Player Name"])
     print(table)
 
     # Export option
@@ -429,42 +582,41 @@ def tech_steal_goals(session):
     """
     Picks target players that are the least "far away" in terms of research levels.
     """
-    settings = load_settings()
-    user_player_name = settings.get("user_player")
-    if not user_player_name:
-        print("User player is not set. Please set it in the Settings menu.")
+    context = _load_user_context(session)
+    if context is None:
         return
-
-    # Get user player's researches
-    user_player = session.query(Player).filter(Player.name == user_player_name).first()
-    if not user_player:
-        print(f"User player '{user_player_name}' not found in the database.")
-        return
-
-    user_researches = {research.name: research.level for research in user_player.researches}
+    user_player, user_researches = context
+    user_player_name = user_player.name
 
     # Calculate "distance" between user and each player
-    players = session.query(Player).filter(Player.name != user_player_name).all()
-    if not players:
+    researches_by_player = get_research_levels_by_player(session, Player.name != user_player_name)
+    if not researches_by_player:
         print("No other players found in the database.")
         return
 
-    distances = []
-    for player in players:
-        target_researches = {research.name: research.level for research in player.researches}
-        # Calculate the sum of absolute differences in research levels
-        all_researches = set(user_researches.keys()).union(set(target_researches.keys()))
-        distance = sum(abs(user_researches.get(research, 0) - target_researches.get(research, 0)) for research in all_researches)
-        distances.append((player.name, distance))
-
-    # Sort players by distance (ascending)
-    sorted_players = sorted(distances, key=lambda x: x[1])
-
-    # Display top N closest players
+    # Lay out levels as a players x researches matrix (missing research = level 0)
+    player_names = list(researches_by_player)
+    research_index = {}
+    for levels in [user_researches, *researches_by_player.values()]:
+        for research in levels:
+            research_index.setdefault(research, len(research_index))
+    level_matrix = np.zeros((len(player_names), len(research_index)), dtype=np.int64)
+    for row, target_researches in enumerate(researches_by_player.values()):
+        for research, level in target_researches.items():
+            level_matrix[row, research_index[research]] = level
+    user_vector = np.zeros(len(research_index), dtype=np.int64)
+    for research, level in user_researches.items():
+        user_vector[research_index[research]] = level
+
+    # Sum of absolute differences in research levels, for all players at once
+    distances = np.abs(level_matrix - user_vector).sum(axis=1)
+
+    # Display top N closest players (stable sort keeps ties in query order)
     top_n = 5  # You can adjust this number as needed
-    closest_players = sorted_players[:top_n]
+    closest = np.argsort(distances, kind='stable')[:top_n]
+    closest_players = [(player_names[i], int(distances[i])) for i in closest]
     print(f"\nTop {top_n} Closest Players to '{user_player_name}' in Research Levels:")
-    table = tabulate(closest_players, headers=["Player Name", "Distance"], tablefmt="pretty")
+    table = format_table(closest_players, ["Player Name", "Distance"])
     print(table)
 
     # Export option
@@ -477,776 +629,279 @@ def settings_menu(session):
     while True:
         print("\n--- Settings Menu ---")
         print("1. Set Player Name as User")
+        print(f"2. Set Export Format (current: {EXPORT_FORMATS[get_export_format()]})")
         print("b. Back to Previous Menu")
         print("e. Exit Program")
-        choice = input("Select an option (1, b, e): ").strip().lower()
+        choice = input("Select an option (1-2, b, e): ").strip().lower()
 
+        action = _NAV.get(choice)
         if choice == '1':
             set_user_player(session)
-        elif choice in ['b', 'back']:
+        elif choice == '2':
+            set_export_format()
+        elif action == 'back':
             print("\nReturning to the Query Menu...")
             break
-        elif choice in ['e', 'exit']:
+        elif action == 'exit':
             confirm_exit()
         else:
             print("Invalid choice. Please select a valid option.")
 
-def compare_tech(session):
+def list_queries():
+    sys.stdout.write(_QUERY_MENU)
+
+def prompt_int(message, default):
     """
-    Compares research levels between the user player and a target player.
-    Displays a table comparing each research's level.
+    Reads an integer from the user, returning `default` on empty or invalid input.
     """
-    settings = load_settings()
-    user_player_name = settings.get("user_player")
-    if not user_player_name:
-        print("User player is not set. Please set it in the Settings menu.")
-        return
-
-    # Get user player's researches
-    user_player = session.query(Player).filter(Player.name == user_player_name).first()
-    if not user_player:
-        print(f"User player '{user_player_name}' not found in the database.")
-        return
-
-    user_researches = {research.name: research.level for research in user_player.researches}
-
-    # Select target player
-    players = session.query(Player.name).filter(Player.name != user_player_name).distinct().all()
-    if not players:
-        print("No other players found in the database.")
-        return
-
-    target_player = get_user_selection(players, "Target Players to Compare Tech")
-    if not target_player:
-        return  # User chose to go back or cancel
-
-    target_player_obj = session.query(Player).filter(Player.name == target_player).first()
-    target_researches = {research.name: research.level for research in target_player_obj.researches}
-
-    # Get all unique research names
-    all_researches = set(user_researches.keys()).union(set(target_researches.keys()))
-
-    # Prepare comparison table
-    comparison = []
-    for research in sorted(all_researches):
-        user_level = user_researches.get(research, 0)
-        target_level = target_researches.get(research, 0)
-        comparison.append((research, user_level, target_level))
-
-    # Display comparison
-    print(f"\nResearch Comparison between '{user_player_name}' and '{target_player}':")
-    table = tabulate(comparison, headers=["Research", f"{user_player_name} Level", f"{target_player} Level"], tablefmt="pretty")
-    print(table)
-
-    # Export option
-    export_results(comparison, ["Research", f"{user_player_name} Level", f"{target_player} Level"])
+    value = input(message).strip()
+    if not value:
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        print(f"Invalid input. Defaulting to {default}.")
+        return default
 
-def tech_steal_targets(session):
+def top_raidable_players(session):
     """
-    Picks a target player to steal tech from based on specific criteria.
+    Shows the players with the most raidable amount of a chosen resource.
     """
-    settings = load_settings()
-    user_player_name = settings.get("user_player")
-    if not user_player_name:
-        print("User player is not set. Please set it in the Settings menu.")
+    resources = get_unique_resources(session)
+    if not resources:
+        print("No resources found in the database.")
         return
+    resource = get_user_selection(resources, "Resources")
+    if resource:
+        limit = prompt_int("Enter the number of top players to display (default 10): ", 10)
+        results = get_players_with_most_raidable_resources(session, resource, limit)
+        if results:
+            table = format_table(results, ["Player Name", "Total Raidable"])
+            print(f"\nTop {limit} Players with Most Raidable {resource.capitalize()}:")
+            print(table)
+            export_results(results, ["Player Name", "Total Raidable"])
+        else:
+            print("No data found for the selected resource.")
 
-    # Get user player's researches
-    user_player = session.query(Player).filter(Player.name == user_player_name).first()
-    if not user_player:
-        print(f"User player '{user_player_name}' not found in the database.")
-        return
-
-    user_researches = {research.name: research.level for research in user_player.researches}
-
-    # Select research to steal
-    researches = session.query(Research.name).distinct().all()
+def top_research_players(session):
+    """
+    Shows the players with the highest level of a chosen research.
+    """
+    researches = get_unique_researches(session)
     if not researches:
         print("No researches found in the database.")
         return
+    research = get_user_selection(researches, "Researches")
+    if research:
+        limit = prompt_int("Enter the number of top players to display (default 10): ", 10)
+        results = get_players_with_highest_research(session, research, limit)
+        if results:
+            table = format_table(results, ["Player Name", "Research Level"])
+            print(f"\nTop {limit} Players with Highest {research} Research:")
+            print(table)
+            export_results(results, ["Player Name", "Research Level"])
+        else:
+            print("No data found for the selected research.")
 
-    selected_research = get_user_selection(researches, "Research to Steal")
-    if not selected_research:
-        return  # User chose to go back or cancel
-
-    selected_research_level = user_researches.get(selected_research, 0) + 1  # Target level to reach
-
-    # Find players who have the selected research at a higher level than the user
-    potential_targets = session.query(Player).join(Player.researches).filter(
-        Research.name == selected_research,
-        Research.level >= selected_research_level
-    ).all()
-
-    if not potential_targets:
-        print(f"No players found with '{selected_research}' level >= {selected_research_level}.")
-        return
-
-    # Further filter players who have equal or lower levels in all other researches
-    suitable_targets = []
-    for target in potential_targets:
-        target_researches = {research.name: research.level for research in target.researches}
-        higher_in_selected = target_researches.get(selected_research, 0) >= selected_research_level
-        lower_or_equal_in_others = all(
-            target_researches.get(research, 0) <= user_researches.get(research, 0)
-            for research in user_researches
-            if research != selected_research
-        )
-        if higher_in_selected and lower_or_equal_in_others:
-            suitable_targets.append(target.name)
-
-    if not suitable_targets:
-        print(f"No suitable targets found for stealing '{selected_research}'.")
+def top_building_players(session):
+    """
+    Shows the players with the highest level of a chosen building.
+    """
+    buildings = get_unique_buildings(session)
+    if not buildings:
+        print("No buildings found in the database.")
         return
+    building = get_user_selection(buildings, "Buildings")
+    if building:
+        limit = prompt_int("Enter the number of top players to display (default 10): ", 10)
+        results = get_players_with_highest_building_level(session, building, limit)
+        if results:
+            table = format_table(results, ["Player Name", "Max Building Level"])
+            print(f"\nTop {limit} Players with Highest Level of {building}:")
+            print(table)
+            export_results(results, ["Player Name", "Max Building Level"])
+        else:
+            print("No data found for the selected building.")
 
-    # Display suitable targets
-    print(f"\nSuitable Targets for Stealing '{selected_research}':")
-    table = tabulate([(name,) for name in suitable_targets], headers=["Player Name"], tablefmt="pretty")
-    print(table)
-
-    # Export option
-    export_results([(name,) for name in suitable_targets], ["Player Name"])
-
-def tech_steal_goals(session):
+def newest_update(session):
     """
-    Picks target players that are the least "far away" in terms of research levels.
+    Shows when a player's data was last updated.
     """
-    settings = load_settings()
-    user_player_name = settings.get("user_player")
-    if not user_player_name:
-        print("User player is not set. Please set it in the Settings menu.")
+    player_name = input("Enter the player name to get the newest update: ").strip()
+    if not player_name:
+        print("Player name cannot be empty.")
         return
-
-    # Get user player's researches
-    user_player = session.query(Player).filter(Player.name == user_player_name).first()
-    if not user_player:
-        print(f"User player '{user_player_name}' not found in the database.")
+    update_time = get_newest_update_for_player(session, player_name)
+    if update_time:
+        print(f"\nNewest Update for Player '{player_name}': {update_time}")
+        while _confirm("Do you want to export the result to CSV? (y/N): "):
+            filename = _prompt_filename()
+            try:
+                write_csv(f"{filename}.csv", ["Player Name", "Newest Update"], [[player_name, update_time]])
+                print(f"Results exported to {filename}.csv")
+                break
+            except Exception as e:
+                print(f"Failed to export results: {e}")
+    else:
+        print(f"No data found for player '{player_name}'.")
+
+def _show_search_results(players):
+    if players:
+        results = [list(row) for row in players]
+        table = format_table(results, ["Player Name", "Race", "Alliance", "Last Update"])
+        print("\nSearch Results:")
+        print(table)
+        export_results(results, ["Player Name", "Race", "Alliance", "Last Update"])
+    else:
+        print("No players found matching the criteria.")
+
+def search_by_name(session):
+    player_name = input("Enter part or full player name to search: ").strip()
+    if not player_name:
+        print("Player name cannot be empty.")
         return
+    _show_search_results(search_players(session, player_name=player_name))
 
-    user_researches = {research.name: research.level for research in user_player.researches}
-
-    # Calculate "distance" between user and each player
-    players = session.query(Player).filter(Player.name != user_player_name).all()
-    if not players:
-        print("No other players found in the database.")
+def search_by_alliance(session):
+    alliance_name = input("Enter part or full alliance name to search: ").strip()
+    if not alliance_name:
+        print("Alliance name cannot be empty.")
         return
+    _show_search_results(search_players(session, alliance_name=alliance_name))
 
-    distances = []
-    for player in players:
-        target_researches = {research.name: research.level for research in player.researches}
-        # Calculate the sum of absolute differences in research levels
-        all_researches = set(user_researches.keys()).union(set(target_researches.keys()))
-        distance = sum(abs(user_researches.get(research, 0) - target_researches.get(research, 0)) for research in all_researches)
-        distances.append((player.name, distance))
-
-    # Sort players by distance (ascending)
-    sorted_players = sorted(distances, key=lambda x: x[1])
-
-    # Display top N closest players
-    top_n = 5  # You can adjust this number as needed
-    closest_players = sorted_players[:top_n]
-    print(f"\nTop {top_n} Closest Players to '{user_player_name}' in Research Levels:")
-    table = tabulate(closest_players, headers=["Player Name", "Distance"], tablefmt="pretty")
-    print(table)
-
-    # Export option
-    export_results(closest_players, ["Player Name", "Distance"])
-
-def settings_menu(session):
+def _run_menu(session, menu, prompt, handlers):
     """
-    Displays the Settings menu.
+    Runs a submenu until the user goes back: writes the menu text, reads a choice
+    and calls the matching handler with the session.
     """
     while True:
-        print("\n--- Settings Menu ---")
-        print("1. Set Player Name as User")
-        print("b. Back to Previous Menu")
-        print("e. Exit Program")
-        choice = input("Select an option (1, b, e): ").strip().lower()
+        sys.stdout.write(menu)
+        choice = input(prompt).strip().lower()
 
-        if choice == '1':
-            set_user_player(session)
-        elif choice in ['b', 'back']:
+        action = _NAV.get(choice)
+        if action == 'exit':
+            confirm_exit()
+        elif action == 'back':
             print("\nReturning to the Query Menu...")
             break
-        elif choice in ['e', 'exit']:
-            confirm_exit()
         else:
-            print("Invalid choice. Please select a valid option.")
+            handler = handlers.get(choice)
+            if handler:
+                handler(session)
+            else:
+                print("Invalid choice. Please select a valid option.")
 
-def list_queries():
-    print("\nAvailable Queries:")
-    print("1. Player Info")
-    print("2. Search")
-    print("3. GDZ Tools")
-    print("4. Settings")
-    print("0. Exit Program")
+def player_info_menu(session):
+    _run_menu(session, _PLAYER_INFO_MENU, "Select an option (1-5, b, e): ", _PLAYER_INFO_HANDLERS)
+
+def search_menu(session):
+    _run_menu(session, _SEARCH_MENU, "Select an option (1-2, b, e): ", _SEARCH_HANDLERS)
+
+def gdz_tools_menu(session):
+    _run_menu(session, _GDZ_TOOLS_MENU, "Select an option (1-2, b, e): ", _GDZ_TOOLS_HANDLERS)
 
 def execute_query(session):
     while True:
+        # Release the objects loaded by the previous query
+        session.expunge_all()
         list_queries()
-        print("Type 'b' or 'back' to go back.")
-        print("Type 'e' or 'exit' to exit the program.")
         choice = input("\nSelect a query option (1-4): ").strip().lower()
 
-        if choice in ['e', 'exit']:
+        action = _NAV.get(choice)
+        if action in ('exit', 'cancel'):
             confirm_exit()
-            continue  # After exiting, loop will stop
-
-        if choice in ['b', 'back']:
+        elif action == 'back':
             print("\nGoing back to the main menu...")
             break
-
-        if choice == '0':
-            confirm_exit()
-            continue
-
-        if choice == '1':
-            # Player Info Submenu
-            while True:
-                print("\n--- Player Info ---")
-                print("1. View Player Details")
-                print("2. Top Players with Most Raidable Resources")
-                print("3. Top Players with Highest Research Level")
-                print("4. Top Players with Highest Building Level")
-                print("5. Get Newest Update for a Player")
-                print("b. Back to Previous Menu")
-                print("e. Exit Program")
-                sub_choice = input("Select an option (1-5, b, e): ").strip().lower()
-
-                if sub_choice in ['e', 'exit']:
-                    confirm_exit()
-                    continue  # After exiting, loop will stop
-
-                if sub_choice in ['b', 'back']:
-                    print("\nReturning to the Query Menu...")
-                    break
-
-                if sub_choice == '1':
-                    # View Player Details
-                    view_player_details(session)
-
-                elif sub_choice == '2':
-                    # Top Players with Most Raidable Resources
-                    resources = get_unique_resources(session)
-                    if not resources:
-                        print("No resources found in the database.")
-                        continue
-                    resource = get_user_selection(resources, "Resources")
-                    if resource:
-                        limit_input = input("Enter the number of top players to display (default 10): ").strip()
-                        try:
-                            limit = int(limit_input) if limit_input else 10
-                        except ValueError:
-                            print("Invalid input. Defaulting to 10.")
-                            limit = 10
-                        results = get_players_with_most_raidable_resources(session, resource, limit)
-                        if results:
-                            table = tabulate(results, headers=["Player Name", "Total Raidable"], tablefmt="pretty")
-                            print(f"\nTop {limit} Players with Most Raidable {resource.capitalize()}:")
-                            print(table)
-                            export_results(results, ["Player Name", "Total Raidable"])
-                        else:
-                            print("No data found for the selected resource.")
-
-                elif sub_choice == '3':
-                    # Top Players with Highest Research Level
-                    researches = get_unique_researches(session)
-                    if not researches:
-                        print("No researches found in the database.")
-                        continue
-                    research = get_user_selection(researches, "Researches")
-                    if research:
-                        limit_input = input("Enter the number of top players to display (default 10): ").strip()
-                        try:
-                            limit = int(limit_input) if limit_input else 10
-                        except ValueError:
-                            print("Invalid input. Defaulting to 10.")
-                            limit = 10
-                        results = get_players_with_highest_research(session, research, limit)
-                        if results:
-                            table = tabulate(results, headers=["Player Name", "Research Level"], tablefmt="pretty")
-                            print(f"\nTop {limit} Players with Highest {research} Research:")
-                            print(table)
-                            export_results(results, ["Player Name", "Research Level"])
-                        else:
-                            print("No data found for the selected research.")
-
-                elif sub_choice == '4':
-                    # Top Players with Highest Building Level
-                    buildings = get_unique_buildings(session)
-                    if not buildings:
-                        print("No buildings found in the database.")
-                        continue
-                    building = get_user_selection(buildings, "Buildings")
-                    if building:
-                        limit_input = input("Enter the number of top players to display (default 10): ").strip()
-                        try:
-                            limit = int(limit_input) if limit_input else 10
-                        except ValueError:
-                            print("Invalid input. Defaulting to 10.")
-                            limit = 10
-                        results = get_players_with_highest_building_level(session, building, limit)
-                        if results:
-                            table = tabulate(results, headers=["Player Name", "Max Building Level"], tablefmt="pretty")
-                            print(f"\nTop {limit} Players with Highest Level of {building}:")
-                            print(table)
-                            export_results(results, ["Player Name", "Max Building Level"])
-                        else:
-                            print("No data found for the selected building.")
-
-                elif sub_choice == '5':
-                    # Get Newest Update for a Player
-                    player_name = input("Enter the player name to get the newest update: ").strip()
-                    if not player_name:
-                        print("Player name cannot be empty.")
-                        continue
-                    update_time = get_newest_update_for_player(session, player_name)
-                    if update_time:
-                        print(f"\nNewest Update for Player '{player_name}': {update_time}")
-                        while True:
-                            export = input("Do you want to export the result to CSV? (y/N): ").strip().lower()
-                            if export == 'y':
-                                df = pd.DataFrame([[player_name, update_time]], columns=["Player Name", "Newest Update"])
-                                while True:
-                                    filename = input("Enter the filename (without extension): ").strip()
-                                    if filename:
-                                        break
-                                    else:
-                                        print("Filename cannot be empty. Please try again.")
-                                try:
-                                    df.to_csv(f"{filename}.csv", index=False)
-                                    print(f"Results exported to {filename}.csv")
-                                    break
-                                except Exception as e:
-                                    print(f"Failed to export results: {e}")
-                            elif export == 'n' or export == '':
-                                # Default is 'No'
-                                break
-                            else:
-                                print("Invalid input. Please enter 'y' or 'n'.")
-                    else:
-                        print(f"No data found for player '{player_name}'.")
-                else:
-                    print("Invalid choice. Please select a valid option.")
-
-        if choice == '2':
-            # Search Submenu
-            while True:
-                print("\n--- Search Menu ---")
-                print("1. Players by Name")
-                print("2. Players by Alliance")
-                print("b. Back to Previous Menu")
-                print("e. Exit Program")
-                sub_choice = input("Select an option (1-2, b, e): ").strip().lower()
-
-                if sub_choice in ['e', 'exit']:
-                    confirm_exit()
-                    continue  # After exiting, loop will stop
-
-                if sub_choice in ['b', 'back']:
-                    print("\nReturning to the Query Menu...")
-                    break
-
-                if sub_choice == '1':
-                    # Players by Name
-                    player_name = input("Enter part or full player name to search: ").strip()
-                    if not player_name:
-                        print("Player name cannot be empty.")
-                        continue
-                    players = search_players(session, player_name=player_name)
-                    if players:
-                        results = [[p.name, p.race, p.alliance.name if p.alliance else 'None', p.last_update] for p in players]
-                        table = tabulate(
-                            results,
-                            headers=["Player Name", "Race", "Alliance", "Last Update"],
-                            tablefmt="pretty"
-                        )
-                        print("\nSearch Results:")
-                        print(table)
-                        export_results(results, ["Player Name", "Race", "Alliance", "Last Update"])
-                    else:
-                        print("No players found matching the criteria.")
-
-                elif sub_choice == '2':
-                    # Players by Alliance
-                    alliance_name = input("Enter part or full alliance name to search: ").strip()
-                    if not alliance_name:
-                        print("Alliance name cannot be empty.")
-                        continue
-                    players = search_players(session, alliance_name=alliance_name)
-                    if players:
-                        results = [[p.name, p.race, p.alliance.name if p.alliance else 'None', p.last_update] for p in players]
-                        table = tabulate(
-                            results,
-                            headers=["Player Name", "Race", "Alliance", "Last Update"],
-                            tablefmt="pretty"
-                        )
-                        print("\nSearch Results:")
-                        print(table)
-                        export_results(results, ["Player Name", "Race", "Alliance", "Last Update"])
-                    else:
-                        print("No players found matching the criteria.")
-
-                else:
-                    print("Invalid choice. Please select a valid option.")
-
-        elif choice == '3':
-            # GDZ Tools Submenu
-            while True:
-                print("\n--- GDZ Tools ---")
-                print("1. Compare Tech")
-                print("2. Tech Steal Targets")
-                print("b. Back to Previous Menu")
-                print("e. Exit Program")
-                sub_choice = input("Select an option (1-2, b, e): ").strip().lower()
-
-                if sub_choice in ['e', 'exit']:
-                    confirm_exit()
-                    continue  # After exiting, loop will stop
-
-                if sub_choice in ['b', 'back']:
-                    print("\nReturning to the Query Menu...")
-                    break
-
-                if sub_choice == '1':
-                    # Compare Tech
-                    compare_tech(session)
-
-                elif sub_choice == '2':
-                    # Tech Steal Targets
-                    tech_steal_targets(session)
-
-                else:
-                    print("Invalid choice. Please select a valid option.")
-
-        elif choice == '4':
-            # Settings Submenu
-            settings_menu(session)
-
         else:
-            print("Invalid choice. Please select a valid option.")
+            handler = _QUERY_HANDLERS.get(choice)
+            if handler:
+                handler(session)
+            else:
+                print("Invalid choice. Please select a valid option.")
+
+# Menu text, rendered once and written in one call per display
+_QUERY_MENU = (
+    "\nAvailable Queries:\n"
+    "1. Player Info\n"
+    "2. Search\n"
+    "3. GDZ Tools\n"
+    "4. Settings\n"
+    "0. Exit Program\n"
+    "Type 'b' or 'back' to go back.\n"
+    "Type 'e' or 'exit' to exit the program.\n"
+)
+_PLAYER_INFO_MENU = (
+    "\n--- Player Info ---\n"
+    "1. View Player Details\n"
+    "2. Top Players with Most Raidable Resources\n"
+    "3. Top Players with Highest Research Level\n"
+    "4. Top Players with Highest Building Level\n"
+    "5. Get Newest Update for a Player\n"
+    "b. Back to Previous Menu\n"
+    "e. Exit Program\n"
+)
+_SEARCH_MENU = (
+    "\n--- Search Menu ---\n"
+    "1. Players by Name\n"
+    "2. Players by Alliance\n"
+    "b. Back to Previous Menu\n"
+    "e. Exit Program\n"
+)
+_GDZ_TOOLS_MENU = (
+    "\n--- GDZ Tools ---\n"
+    "1. Compare Tech\n"
+    "2. Tech Steal Targets\n"
+    "b. Back to Previous Menu\n"
+    "e. Exit Program\n"
+)
+
+# Menu choice -> handler(session)
+_PLAYER_INFO_HANDLERS = {
+    '1': view_player_details,
+    '2': top_raidable_players,
+    '3': top_research_players,
+    '4': top_building_players,
+    '5': newest_update,
+}
+_SEARCH_HANDLERS = {'1': search_by_name, '2': search_by_alliance}
+_GDZ_TOOLS_HANDLERS = {'1': compare_tech, '2': tech_steal_targets}
+_QUERY_HANDLERS = {
+    '1': player_info_menu,
+    '2': search_menu,
+    '3': gdz_tools_menu,
+    '4': settings_menu,
+}
 
 def show_player_resources(session, player_name):
     """
     Displays a player's planets, their resources, sum total per planet, and a grand total of all resources.
     Includes Planet Type as the second column after Coordinates.
     """
-    planets_resources = get_player_planets_and_resources(session, player_name)
-    if not planets_resources:
+    # Get all unique resource types for headers
+    resource_types = get_unique_resources(session)
+    resource_types = sorted(resource_types)
+
+    # One row per planet, already pivoted by the database
+    planet_rows = get_player_resource_table(session, player_name, resource_types)
+    if not planet_rows:
         print(f"No planets found for player '{player_name}'.")
         return
 
-    # Organize data per planet
-    planet_dict = {}
-    for coord, planet_type, res_type, raidable in planets_resources:
-        if coord not in planet_dict:
-            planet_dict[coord] = {
-                "Planet Type": planet_type,
-                "Resources": {}
-            }
-        planet_dict[coord]["Resources"][res_type] = raidable
-
-    # Get all unique resource types for headers
-    resource_types = session.query(Resource.type).distinct().all()
-    resource_types = sorted([res[0] for res in resource_types])
-
     # Prepare table data
     headers = ["Coordinates", "Planet Type"] + resource_types + ["Total"]
-    table = []
-    grand_total = 0.0
-    for coord, data in planet_dict.items():
-        planet_type = data["Planet Type"]
-        row = [coord, planet_type]
-        total = 0.0
-        for res in resource_types:
-            amount = data["Resources"].get(res, 0.0)
-            row.append(amount)
-            total += amount
-        row.append(total)
-        grand_total += total
-        table.append(row)
+    table = [[*row, sum(row[2:], 0.0)] for row in planet_rows]
+    grand_total = sum(row[-1] for row in table)
 
     # Append grand total row
-    grand_total_row = ["Grand Total", "", *[""] * len(resource_types), grand_total]
+    # Blank (None) resource cells keep those columns numeric for Feather/Parquet exports
+    grand_total_row = ["Grand Total", "", *[None] * len(resource_types), grand_total]
     table.append(grand_total_row)
 
     # Display data
     print(f"\nPlayer: {player_name}")
     print("\nPlanets and Their Resources:")
-    print(tabulate(table, headers=headers, tablefmt="pretty"))
+    print(format_table(table, headers))
 
     # Export option
-    while True:
-        export = input("Do you want to export the results to CSV? (y/N): ").strip().lower()
-        if export == 'y':
-            # Prepare data for CSV
-            df = pd.DataFrame(table, columns=headers)
-            while True:
-                filename = input("Enter the filename (without extension): ").strip()
-                if filename:
-                    break
-                else:
-                    print("Filename cannot be empty. Please try again.")
-            try:
-                df.to_csv(f"{filename}.csv", index=False)
-                print(f"Results exported to {filename}.csv")
-                break
-            except Exception as e:
-                print(f"Failed to export results: {e}")
-        elif export == 'n' or export == '':
-            # Default is 'No'
-            break
-        else:
-            print("Invalid input. Please enter 'y' or 'n'.")
-
-def list_queries():
-    print("\nAvailable Queries:")
-    print("1. Player Info")
-    print("2. Search")
-    print("3. GDZ Tools")
-    print("4. Settings")
-    print("0. Exit Program")
-
-def execute_query(session):
-    while True:
-        list_queries()
-        print("Type 'b' or 'back' to go back.")
-        print("Type 'e' or 'exit' to exit the program.")
-        choice = input("\nSelect a query option (1-4): ").strip().lower()
-
-        if choice in ['e', 'exit']:
-            confirm_exit()
-            continue  # After exiting, loop will stop
-
-        if choice in ['b', 'back']:
-            print("\nGoing back to the main menu...")
-            break
-
-        if choice == '0':
-            confirm_exit()
-            continue
-
-        if choice == '1':
-            # Player Info Submenu
-            while True:
-                print("\n--- Player Info ---")
-                print("1. View Player Details")
-                print("2. Top Players with Most Raidable Resources")
-                print("3. Top Players with Highest Research Level")
-                print("4. Top Players with Highest Building Level")
-                print("5. Get Newest Update for a Player")
-                print("b. Back to Previous Menu")
-                print("e. Exit Program")
-                sub_choice = input("Select an option (1-5, b, e): ").strip().lower()
-
-                if sub_choice in ['e', 'exit']:
-                    confirm_exit()
-                    continue  # After exiting, loop will stop
-
-                if sub_choice in ['b', 'back']:
-                    print("\nReturning to the Query Menu...")
-                    break
-
-                if sub_choice == '1':
-                    # View Player Details
-                    view_player_details(session)
-
-                elif sub_choice == '2':
-                    # Top Players with Most Raidable Resources
-                    resources = get_unique_resources(session)
-                    if not resources:
-                        print("No resources found in the database.")
-                        continue
-                    resource = get_user_selection(resources, "Resources")
-                    if resource:
-                        limit_input = input("Enter the number of top players to display (default 10): ").strip()
-                        try:
-                            limit = int(limit_input) if limit_input else 10
-                        except ValueError:
-                            print("Invalid input. Defaulting to 10.")
-                            limit = 10
-                        results = get_players_with_most_raidable_resources(session, resource, limit)
-                        if results:
-                            table = tabulate(results, headers=["Player Name", "Total Raidable"], tablefmt="pretty")
-                            print(f"\nTop {limit} Players with Most Raidable {resource.capitalize()}:")
-                            print(table)
-                            export_results(results, ["Player Name", "Total Raidable"])
-                        else:
-                            print("No data found for the selected resource.")
-
-                elif sub_choice == '3':
-                    # Top Players with Highest Research Level
-                    researches = get_unique_researches(session)
-                    if not researches:
-                        print("No researches found in the database.")
-                        continue
-                    research = get_user_selection(researches, "Researches")
-                    if research:
-                        limit_input = input("Enter the number of top players to display (default 10): ").strip()
-                        try:
-                            limit = int(limit_input) if limit_input else 10
-                        except ValueError:
-                            print("Invalid input. Defaulting to 10.")
-                            limit = 10
-                        results = get_players_with_highest_research(session, research, limit)
-                        if results:
-                            table = tabulate(results, headers=["Player Name", "Research Level"], tablefmt="pretty")
-                            print(f"\nTop {limit} Players with Highest {research} Research:")
-                            print(table)
-                            export_results(results, ["Player Name", "Research Level"])
-                        else:
-                            print("No data found for the selected research.")
-
-                elif sub_choice == '4':
-                    # Top Players with Highest Building Level
-                    buildings = get_unique_buildings(session)
-                    if not buildings:
-                        print("No buildings found in the database.")
-                        continue
-                    building = get_user_selection(buildings, "Buildings")
-                    if building:
-                        limit_input = input("Enter the number of top players to display (default 10): ").strip()
-                        try:
-                            limit = int(limit_input) if limit_input else 10
-                        except ValueError:
-                            print("Invalid input. Defaulting to 10.")
-                            limit = 10
-                        results = get_players_with_highest_building_level(session, building, limit)
-                        if results:
-                            table = tabulate(results, headers=["Player Name", "Max Building Level"], tablefmt="pretty")
-                            print(f"\nTop {limit} Players with Highest Level of {building}:")
-                            print(table)
-                            export_results(results, ["Player Name", "Max Building Level"])
-                        else:
-                            print("No data found for the selected building.")
-
-                elif sub_choice == '5':
-                    # Get Newest Update for a Player
-                    player_name = input("Enter the player name to get the newest update: ").strip()
-                    if not player_name:
-                        print("Player name cannot be empty.")
-                        continue
-                    update_time = get_newest_update_for_player(session, player_name)
-                    if update_time:
-                        print(f"\nNewest Update for Player '{player_name}': {update_time}")
-                        while True:
-                            export = input("Do you want to export the result to CSV? (y/N): ").strip().lower()
-                            if export == 'y':
-                                df = pd.DataFrame([[player_name, update_time]], columns=["Player Name", "Newest Update"])
-                                while True:
-                                    filename = input("Enter the filename (without extension): ").strip()
-                                    if filename:
-                                        break
-                                    else:
-                                        print("Filename cannot be empty. Please try again.")
-                                try:
-                                    df.to_csv(f"{filename}.csv", index=False)
-                                    print(f"Results exported to {filename}.csv")
-                                    break
-                                except Exception as e:
-                                    print(f"Failed to export results: {e}")
-                            elif export == 'n' or export == '':
-                                # Default is 'No'
-                                break
-                            else:
-                                print("Invalid input. Please enter 'y' or 'n'.")
-                    else:
-                        print(f"No data found for player '{player_name}'.")
-                else:
-                    print("Invalid choice. Please select a valid option.")
-
-        if choice == '2':
-            # Search Submenu
-            while True:
-                print("\n--- Search Menu ---")
-                print("1. Players by Name")
-                print("2. Players by Alliance")
-                print("b. Back to Previous Menu")
-                print("e. Exit Program")
-                sub_choice = input("Select an option (1-2, b, e): ").strip().lower()
-
-                if sub_choice in ['e', 'exit']:
-                    confirm_exit()
-                    continue  # After exiting, loop will stop
-
-                if sub_choice in ['b', 'back']:
-                    print("\nReturning to the Query Menu...")
-                    break
-
-                if sub_choice == '1':
-                    # Players by Name
-                    player_name = input("Enter part or full player name to search: ").strip()
-                    if not player_name:
-                        print("Player name cannot be empty.")
-                        continue
-                    players = search_players(session, player_name=player_name)
-                    if players:
-                        results = [[p.name, p.race, p.alliance.name if p.alliance else 'None', p.last_update] for p in players]
-                        table = tabulate(
-                            results,
-                            headers=["Player Name", "Race", "Alliance", "Last Update"],
-                            tablefmt="pretty"
-                        )
-                        print("\nSearch Results:")
-                        print(table)
-                        export_results(results, ["Player Name", "Race", "Alliance", "Last Update"])
-                    else:
-                        print("No players found matching the criteria.")
-
-                elif sub_choice == '2':
-                    # Players by Alliance
-                    alliance_name = input("Enter part or full alliance name to search: ").strip()
-                    if not alliance_name:
-                        print("Alliance name cannot be empty.")
-                        continue
-                    players = search_players(session, alliance_name=alliance_name)
-                    if players:
-                        results = [[p.name, p.race, p.alliance.name if p.alliance else 'None', p.last_update] for p in players]
-                        table = tabulate(
-                            results,
-                            headers=["Player Name", "Race", "Alliance", "Last Update"],
-                            tablefmt="pretty"
-                        )
-                        print("\nSearch Results:")
-                        print(table)
-                        export_results(results, ["Player Name", "Race", "Alliance", "Last Update"])
-                    else:
-                        print("No players found matching the criteria.")
-
-                else:
-                    print("Invalid choice. Please select a valid option.")
-
-        elif choice == '3':
-            # GDZ Tools Submenu
-            while True:
-                print("\n--- GDZ Tools ---")
-                print("1. Compare Tech")
-                print("2. Tech Steal Targets")
-                print("b. Back to Previous Menu")
-                print("e. Exit Program")
-                sub_choice = input("Select an option (1-2, b, e): ").strip().lower()
-
-                if sub_choice in ['e', 'exit']:
-                    confirm_exit()
-                    continue  # After exiting, loop will stop
-
-                if sub_choice in ['b', 'back']:
-                    print("\nReturning to the Query Menu...")
-                    break
-
-                if sub_choice == '1':
-                    # Compare Tech
-                    compare_tech(session)
-
-                elif sub_choice == '2':
-                    # Tech Steal Targets
-                    tech_steal_targets(session)
-
-                else:
-                    print("Invalid choice. Please select a valid option.")
-
-        elif choice == '4':
-            # Settings Submenu
-            settings_menu(session)
-
-        else:
-            print("Invalid choice. Please select a valid option.")
+    export_results(table, headers)